@@ -3,15 +3,241 @@
 Real AI Image Generation using Google GenAI with Vertex AI
 """
 import os
+import re
 import sys
 import json
 import base64
+import functools
+import threading
 from google import genai
 from google.genai import types
 import io
-from PIL import Image as PILImage
+from PIL import Image as PILImage, ImageFont
 import hashlib
+import image_cache
+import ndjson_worker
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+_HEX_RE = re.compile(r'#[0-9A-Fa-f]{6}')
+
+FONT_BOLD = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+FONT_REGULAR = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+@functools.lru_cache(maxsize=8)
+def _get_font(path: str, size: int):
+    """Load a TrueType font once per (path, size); None if it is unavailable"""
+    try:
+        return ImageFont.truetype(path, size=size)
+    except OSError:
+        return None
+
+@functools.lru_cache(maxsize=1)
+def _get_default_font():
+    return ImageFont.load_default()
+
+_client = None
+_client_lock = threading.Lock()
+
+def _resolve_api_key() -> str:
+    """Get API key from environment"""
+    api_key = os.environ.get("VERTEX_API_KEY")
+    if not api_key:
+        # Fallback to other possible keys
+        api_key = os.environ.get("GOOGLE_CLOUD_API_KEY") or os.environ.get("GEMINI_API_KEY")
+    
+    if not api_key:
+        raise ValueError("No API key found. Please set VERTEX_API_KEY, GOOGLE_CLOUD_API_KEY, or GEMINI_API_KEY")
+    return api_key
+
+def _get_client():
+    """
+    Return the process-wide GenAI client, creating it on first use so its
+    connection pool and credentials are reused across requests
+    """
+    global _client
+    if _client is None:
+        # Batch threads may all arrive here at once; build only one client
+        with _client_lock:
+            if _client is None:
+                # Use either API key OR project/location, not both
+                # When using API key, don't specify project/location
+                _client = genai.Client(
+                    vertexai=True,
+                    api_key=_resolve_api_key()
+                )
+    return _client
+
+# Imagen models to try for text-to-image generation, newest first
+IMAGEN_MODELS = [
+    "imagen-3.0-generate-002",
+    "imagen-4.0-fast-generate-001",
+    "imagegeneration@006",
+    "imagegeneration@005"
+]
+
+# Output dimensions for each supported aspect ratio
+ASPECT_MAP = {
+    "1:1": (1024, 1024),
+    "16:9": (1024, 576),
+    "9:16": (576, 1024),
+    "4:3": (1024, 768),
+    "3:4": (768, 1024)
+}
+
+SAFETY_SETTINGS = [
+    types.SafetySetting(category=category, threshold="OFF")
+    for category in (
+        "HARM_CATEGORY_HATE_SPEECH",
+        "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "HARM_CATEGORY_HARASSMENT"
+    )
+]
+
+# Shared, read-only request config for every Imagen call
+IMAGE_GENERATION_CONFIG = types.GenerateContentConfig(
+    temperature=0.8,
+    top_p=0.95,
+    response_modalities=["IMAGE"],
+    safety_settings=SAFETY_SETTINGS
+)
+
+# Upper bound on prompts generated concurrently by generate_images_with_genai
+MAX_BATCH_SIZE = 16
+
+# Upper bound on GenAI API calls in flight across all threads. A full batch
+# racing every Imagen candidate would otherwise issue MAX_BATCH_SIZE *
+# len(IMAGEN_MODELS) calls at once
+MAX_CONCURRENT_GENAI_CALLS = 16
+_genai_slots = threading.BoundedSemaphore(MAX_CONCURRENT_GENAI_CALLS)
+
+# Race Imagen candidates concurrently; enabled by serve() for the persistent worker
+RACE_IMAGEN_MODELS = False
+
+# Last model that returned an image; tried on its own before racing the rest
+_preferred_model = None
+_preferred_lock = threading.Lock()
+
+def _try_imagen_model(client, model_name: str, prompt: str, aspect_ratio: str, cancelled=None):
+    """
+    Request an image from a single Imagen model
+    
+    Args:
+        cancelled: Optional threading.Event; once set, an attempt still waiting
+            for an API slot gives up without calling the model
+    
+    Returns:
+        result dict if the model produced an image, otherwise None
+    """
+    with _genai_slots:
+        if cancelled is not None and cancelled.is_set():
+            return None
+        response = client.models.generate_content(
+            model=model_name,
+            contents=[
+                types.Content(
+                    role="user",
+                    parts=[
+                        types.Part.from_text(text=prompt)
+                    ]
+                )
+            ],
+            config=IMAGE_GENERATION_CONFIG
+        )
+    
+    # Extract image from response
+    if response and response.candidates:
+        for part in response.candidates[0].content.parts:
+            if hasattr(part, 'inline_data') and part.inline_data:
+                if part.inline_data.mime_type.startswith('image/'):
+                    data = part.inline_data.data
+                    # Pass through data that already arrives base64 encoded
+                    if isinstance(data, (bytes, bytearray)):
+                        data = base64.b64encode(data).decode('ascii')
+                    return {
+                        "success": True,
+                        "image_data": data,
+                        "mime_type": part.inline_data.mime_type,
+                        "prompt": prompt,
+                        "aspect_ratio": aspect_ratio,
+                        "model": model_name
+                    }
+    return None
+
+def _race_imagen_models(client, prompt: str, aspect_ratio: str):
+    """
+    Find an Imagen candidate that returns an image
+    
+    In --server mode every candidate is fired concurrently and the first image
+    wins. Requests already in flight cannot be cancelled, so the losers finish
+    in the background; that is harmless in a long-lived worker but would keep a
+    one-shot process from exiting until the slowest model answers. One-shot
+    runs therefore try the candidates in order.
+    
+    Returns:
+        (result dict or None, last error message or None)
+    """
+    global _preferred_model
+    last_error = None
+    candidates = list(IMAGEN_MODELS)
+    
+    # Skip the race entirely when the model that worked last time still works.
+    # Read the global once: batch threads may clear or replace it concurrently
+    preferred = _preferred_model
+    if preferred:
+        try:
+            result = _try_imagen_model(client, preferred, prompt, aspect_ratio)
+            if result:
+                return result, None
+        except Exception as e:
+            last_error = str(e)
+        candidates.remove(preferred)
+        with _preferred_lock:
+            if _preferred_model == preferred:
+                _preferred_model = None
+    
+    if not candidates:
+        return None, last_error
+    
+    if not RACE_IMAGEN_MODELS:
+        for model_name in candidates:
+            try:
+                result = _try_imagen_model(client, model_name, prompt, aspect_ratio)
+            except Exception as e:
+                last_error = str(e)
+                continue
+            if result:
+                with _preferred_lock:
+                    _preferred_model = model_name
+                return result, None
+        return None, last_error
+    
+    won = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(candidates))
+    try:
+        futures = {
+            executor.submit(_try_imagen_model, client, model_name, prompt, aspect_ratio, won): model_name
+            for model_name in candidates
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                last_error = str(e)
+                continue
+            if result:
+                with _preferred_lock:
+                    _preferred_model = futures[future]
+                return result, None
+    finally:
+        # Don't wait on the losers; drop any that have not started yet or are
+        # still queued for an API slot
+        won.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    return None, last_error
+
+@image_cache.cached("genai", skip_models=("fallback-gradient",))
 def generate_image_with_genai(prompt: str, aspect_ratio: str = "16:9") -> dict:
     """
     Generate an image using Google GenAI with Imagen model
@@ -21,169 +247,69 @@ def generate_image_with_genai(prompt: str, aspect_ratio: str = "16:9") -> dict:
         aspect_ratio: The desired aspect ratio
     
     Returns:
-        dict with image data and metadata
+        dict with image data and metadata; image_data is always a base64
+        string, ready for a data:<mime_type>;base64,... URL
     """
     
     try:
-        # Get API key from environment
-        api_key = os.environ.get("VERTEX_API_KEY")
-        if not api_key:
-            # Fallback to other possible keys
-            api_key = os.environ.get("GOOGLE_CLOUD_API_KEY") or os.environ.get("GEMINI_API_KEY")
+        client = _get_client()
         
-        if not api_key:
-            raise ValueError("No API key found. Please set VERTEX_API_KEY, GOOGLE_CLOUD_API_KEY, or GEMINI_API_KEY")
-        
-        # Initialize the client - use either API key OR project/location, not both
-        # When using API key, don't specify project/location
-        client = genai.Client(
-            vertexai=True,
-            api_key=api_key
-        )
+        # Race all Imagen candidates concurrently and take the first image back
+        result, last_error = _race_imagen_models(client, prompt, aspect_ratio)
+        if result:
+            return result
         
-        # Try to use Imagen for text-to-image generation
-        # First try with the newer Imagen models
-        model_options = [
-            "imagen-3.0-generate-002",
-            "imagen-4.0-fast-generate-001",
-            "imagegeneration@006",
-            "imagegeneration@005"
-        ]
-        
-        success = False
-        last_error = None
-        
-        for model_name in model_options:
-            try:
-                # Attempt image generation with current model
+        # If all models failed, try a fallback approach with Gemini
+        try:
+            # Use Gemini to generate a creative image description, then create a simple colored image
+            with _genai_slots:
                 response = client.models.generate_content(
-                    model=model_name,
+                    model="gemini-2.0-flash-exp",
                     contents=[
                         types.Content(
                             role="user",
                             parts=[
-                                types.Part.from_text(text=prompt)
+                                types.Part.from_text(
+                                    text=f"Based on this prompt: '{prompt}', describe the dominant colors and mood in hex color codes. Return only: color1:#XXXXXX color2:#XXXXXX"
+                                )
                             ]
                         )
-                    ],
-                    config=types.GenerateContentConfig(
-                        temperature=0.8,
-                        top_p=0.95,
-                        response_modalities=["IMAGE"],
-                        safety_settings=[
-                            types.SafetySetting(
-                                category="HARM_CATEGORY_HATE_SPEECH",
-                                threshold="OFF"
-                            ),
-                            types.SafetySetting(
-                                category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                                threshold="OFF"
-                            ),
-                            types.SafetySetting(
-                                category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                                threshold="OFF"
-                            ),
-                            types.SafetySetting(
-                                category="HARM_CATEGORY_HARASSMENT",
-                                threshold="OFF"
-                            )
-                        ]
-                    )
+                    ]
                 )
-                
-                # Extract image from response
-                if response and response.candidates:
-                    for part in response.candidates[0].content.parts:
-                        if hasattr(part, 'inline_data') and part.inline_data:
-                            if part.inline_data.mime_type.startswith('image/'):
-                                return {
-                                    "success": True,
-                                    "image_data": base64.b64encode(part.inline_data.data).decode('utf-8'),
-                                    "mime_type": part.inline_data.mime_type,
-                                    "prompt": prompt,
-                                    "aspect_ratio": aspect_ratio,
-                                    "model": model_name
-                                }
-                
-                # If no image in response, try next model
-                continue
-                
-            except Exception as e:
-                last_error = str(e)
-                continue
-        
-        # If all models failed, try a fallback approach with Gemini
-        try:
-            # Use Gemini to generate a creative image description, then create a simple colored image
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-exp",
-                contents=[
-                    types.Content(
-                        role="user",
-                        parts=[
-                            types.Part.from_text(
-                                text=f"Based on this prompt: '{prompt}', describe the dominant colors and mood in hex color codes. Return only: color1:#XXXXXX color2:#XXXXXX"
-                            )
-                        ]
-                    )
-                ]
-            )
             
             # Extract colors from response
             text_response = response.text if hasattr(response, 'text') else str(response)
             
             # Parse colors or use defaults
-            import re
-            colors = re.findall(r'#[0-9A-Fa-f]{6}', text_response)
+            colors = _HEX_RE.findall(text_response)
             if len(colors) >= 2:
                 color1, color2 = colors[0], colors[1]
             else:
-                # Default colors based on prompt hash
-                hash_obj = hashlib.md5(prompt.encode())
-                hash_hex = hash_obj.hexdigest()
-                color1 = f"#{hash_hex[:6]}"
-                color2 = f"#{hash_hex[6:12]}"
+                # Default colors based on a short non-cryptographic prompt hash
+                h = int.from_bytes(hashlib.blake2b(prompt.encode(), digest_size=6).digest(), 'big')
+                color1 = f"#{h >> 24:06x}"
+                color2 = f"#{h & 0xFFFFFF:06x}"
             
             # Create a gradient image with PIL
-            from PIL import Image as PILImage, ImageDraw, ImageFont
+            from PIL import ImageDraw
             
             # Determine dimensions
-            aspect_map = {
-                "1:1": (1024, 1024),
-                "16:9": (1024, 576),
-                "9:16": (576, 1024),
-                "4:3": (1024, 768),
-                "3:4": (768, 1024)
-            }
-            width, height = aspect_map.get(aspect_ratio, (1024, 576))
-            
-            # Create gradient image
-            img = PILImage.new('RGB', (width, height))
-            draw = ImageDraw.Draw(img)
+            width, height = ASPECT_MAP.get(aspect_ratio, (1024, 576))
             
             # Convert hex to RGB
-            def hex_to_rgb(hex_color):
-                hex_color = hex_color.lstrip('#')
-                return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-            
-            rgb1 = hex_to_rgb(color1)
-            rgb2 = hex_to_rgb(color2)
+            rgb1 = tuple(bytes.fromhex(color1.lstrip('#')))
+            rgb2 = tuple(bytes.fromhex(color2.lstrip('#')))
             
-            # Draw gradient
-            for y in range(height):
-                ratio = y / height
-                r = int(rgb1[0] * (1 - ratio) + rgb2[0] * ratio)
-                g = int(rgb1[1] * (1 - ratio) + rgb2[1] * ratio)
-                b = int(rgb1[2] * (1 - ratio) + rgb2[2] * ratio)
-                draw.rectangle([(0, y), (width, y+1)], fill=(r, g, b))
+            # Blend two solid fills through PIL's built-in gradient mask so the
+            # whole gradient is produced in C with no per-row Python work
+            mask = PILImage.linear_gradient('L').resize((width, height))
+            solid1 = PILImage.new('RGB', (width, height), rgb1)
+            solid2 = PILImage.new('RGB', (width, height), rgb2)
+            img = PILImage.composite(solid2, solid1, mask)
+            draw = ImageDraw.Draw(img)
             
-            # Add text overlay
-            try:
-                from PIL import ImageFont
-                # Try to use a better font if available
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", size=int(height * 0.05))
-            except:
-                font = ImageFont.load_default()
+            # Add text overlay, preferring a better font if available
+            font = _get_font(FONT_BOLD, int(height * 0.05)) or _get_default_font()
             
             # Add prompt text
             text = "AI Generated"
@@ -196,19 +322,21 @@ def generate_image_with_genai(prompt: str, aspect_ratio: str = "16:9") -> dict:
             
             # Add prompt snippet
             prompt_text = prompt[:60] + "..." if len(prompt) > 60 else prompt
-            try:
-                small_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", size=int(height * 0.025))
-            except:
-                small_font = font
+            small_font = _get_font(FONT_REGULAR, int(height * 0.025)) or font
             bbox = draw.textbbox((0, 0), prompt_text, font=small_font)
             text_width = bbox[2] - bbox[0]
             x = (width - text_width) // 2
             y = height // 2 + 20
             draw.text((x, y), prompt_text, fill=(255, 255, 255, 200), font=small_font)
             
+            # Quantize to a 256-color palette: the smooth gradient and the
+            # anti-aliased text edges pick up a small per-channel error, in
+            # exchange for a PNG a fraction of the RGB payload size
+            img = img.convert('P', palette=PILImage.Palette.ADAPTIVE, colors=256)
+            
             # Convert to base64
             buffer = io.BytesIO()
-            img.save(buffer, format='PNG')
+            img.save(buffer, format='PNG', compress_level=1, optimize=False)
             image_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
             
             return {
@@ -235,29 +363,85 @@ def generate_image_with_genai(prompt: str, aspect_ratio: str = "16:9") -> dict:
             "prompt": prompt
         }
 
+def generate_images_with_genai(prompts: list, aspect_ratio: str = "16:9") -> list:
+    """
+    Generate several images at once
+    
+    Prompts are processed concurrently in batches of at most MAX_BATCH_SIZE,
+    so K prompts cost roughly one round-trip per batch instead of K. API
+    calls across the whole batch are capped at MAX_CONCURRENT_GENAI_CALLS.
+    
+    Args:
+        prompts: The text prompts to generate images from
+        aspect_ratio: The desired aspect ratio for every image
+    
+    Returns:
+        list of result dicts, in the same order as prompts
+    """
+    results = []
+    for start in range(0, len(prompts), MAX_BATCH_SIZE):
+        batch = prompts[start:start + MAX_BATCH_SIZE]
+        with ThreadPoolExecutor(max_workers=len(batch)) as executor:
+            results.extend(executor.map(lambda p: generate_image_with_genai(p, aspect_ratio), batch))
+    return results
+
+def handle_request(input_data: dict) -> dict:
+    """
+    Run one generation request
+    
+    Args:
+        input_data: {"prompt": ..., "aspectRatio": ...} or {"prompts": [...], "aspectRatio": ...}
+    
+    Returns:
+        result dict, {"results": [...]} for batches, or {"error": ...}
+    """
+    prompt = input_data.get('prompt', '')
+    prompts = input_data.get('prompts')
+    aspect_ratio = input_data.get('aspectRatio', '16:9')
+    
+    # Batch request: {"prompts": [...]} -> {"results": [...]}
+    if prompts is not None and not ndjson_worker.is_prompt_list(prompts):
+        return {"error": "prompts must be a list of non-empty strings"}
+    if prompts:
+        return {"results": generate_images_with_genai(prompts, aspect_ratio)}
+    
+    if not prompt:
+        return {"error": "No prompt provided"}
+    
+    return generate_image_with_genai(prompt, aspect_ratio)
+
+def serve():
+    """
+    Run the persistent NDJSON worker, so imports and the GenAI client are set
+    up once instead of per image. Imagen candidates are raced in this mode.
+    """
+    global RACE_IMAGEN_MODELS
+    RACE_IMAGEN_MODELS = True
+    ndjson_worker.serve(handle_request)
+
 def main():
     """Main entry point for command-line usage"""
     if len(sys.argv) < 2:
         print(json.dumps({"error": "No input provided"}))
         sys.exit(1)
     
+    if sys.argv[1] == "--server":
+        serve()
+        return
+    
     try:
         # Parse input JSON
         input_data = json.loads(sys.argv[1])
         
-        # Extract parameters
-        prompt = input_data.get('prompt', '')
-        aspect_ratio = input_data.get('aspectRatio', '16:9')
-        
-        if not prompt:
+        if not input_data.get('prompt') and not input_data.get('prompts'):
             print(json.dumps({"error": "No prompt provided"}))
             sys.exit(1)
         
-        # Generate image
-        result = generate_image_with_genai(prompt, aspect_ratio)
+        # Generate image(s)
+        result = handle_request(input_data)
         
         # Output result as JSON
-        print(json.dumps(result))
+        ndjson_worker.write_result(result)
         
     except json.JSONDecodeError as e:
         print(json.dumps({"error": f"Invalid JSON input: {str(e)}"}))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Persistent prompt -> image cache shared by the Python image generators
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import functools
+
+def _env_int(name: str, default: int) -> int:
+    """Read a non-negative integer setting, ignoring malformed values"""
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+# Where cached images live, how long they stay valid and how much image data
+# is kept. The default path is often RAM-backed (e.g. /tmp on Cloud Run), so
+# the size cap is deliberately small
+CACHE_PATH = os.environ.get("AIMM_IMAGE_CACHE_PATH") or os.path.join(
+    tempfile.gettempdir(), "aimm_image_cache.sqlite3"
+)
+CACHE_TTL_SECONDS = _env_int("AIMM_IMAGE_CACHE_TTL", 7 * 24 * 3600)
+CACHE_MAX_BYTES = _env_int("AIMM_IMAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+CACHE_ENABLED = os.environ.get("AIMM_IMAGE_CACHE", "1").lower() not in ("", "0", "false")
+
+# Expired and excess rows are pruned on the first write and then whenever this
+# much image data has been written since, rather than on every write
+PRUNE_EVERY_BYTES = CACHE_MAX_BYTES // 16
+
+# Unicode-aware, so prompts in any script keep their words in the loose key
+_WORD_RE = re.compile(r"\w+")
+
+# Bump when the table layout or key scheme changes; older caches are dropped
+SCHEMA_VERSION = 3
+
+_conn = None
+_lock = threading.Lock()
+_bytes_since_prune = None
+
+def _connect():
+    """Open (and create if needed) the cache database once per process"""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        if _conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            _conn.execute("DROP TABLE IF EXISTS images")
+            _conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                exact_key TEXT PRIMARY KEY,
+                loose_key TEXT NOT NULL,
+                image_data TEXT NOT NULL,
+                mime_type TEXT NOT NULL,
+                model TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+            """
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS images_loose_key ON images (loose_key)")
+        # Covers the pruning scans, so they never read the image data
+        _conn.execute("CREATE INDEX IF NOT EXISTS images_created_at ON images (created_at, size)")
+        _conn.commit()
+    return _conn
+
+def _hash(parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def make_keys(generator: str, prompt: str, aspect_ratio: str):
+    """
+    Build the lookup keys for a request
+
+    Returns:
+        (exact_key, loose_key) - the loose key ignores case, punctuation and
+        spacing so trivially reworded prompts still hit. It is None when the
+        prompt has no words or is already normalized, since a loose lookup
+        would then either match unrelated prompts or repeat the exact one.
+    """
+    exact_key = _hash([generator, prompt, aspect_ratio])
+    normalized = " ".join(_WORD_RE.findall(prompt.casefold()))
+    if not normalized or normalized == prompt:
+        return exact_key, None
+    return exact_key, _hash([generator, normalized, aspect_ratio])
+
+def get(generator: str, prompt: str, aspect_ratio: str, exact_only: bool = False):
+    """
+    Look up a previously generated image
+
+    Args:
+        exact_only: Skip the loose-key fallback, for images that depend on
+            the literal prompt text (e.g. renders that print it)
+
+    Returns:
+        dict with image_data, mime_type and model, or None on a miss
+    """
+    if not CACHE_ENABLED:
+        return None
+    exact_key, loose_key = make_keys(generator, prompt, aspect_ratio)
+    cutoff = time.time() - CACHE_TTL_SECONDS
+    try:
+        with _lock:
+            conn = _connect()
+            row = conn.execute(
+                "SELECT image_data, mime_type, model FROM images WHERE exact_key = ? AND created_at > ?",
+                (exact_key, cutoff),
+            ).fetchone()
+            if row is None and loose_key is not None and not exact_only:
+                row = conn.execute(
+                    "SELECT image_data, mime_type, model FROM images WHERE loose_key = ? AND created_at > ? "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (loose_key, cutoff),
+                ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    return {"image_data": row[0], "mime_type": row[1], "model": row[2]}
+
+def _prune(conn, now: float):
+    """Drop expired rows, then the oldest rows beyond CACHE_MAX_BYTES in total"""
+    conn.execute("DELETE FROM images WHERE created_at <= ?", (now - CACHE_TTL_SECONDS,))
+    conn.execute(
+        "DELETE FROM images WHERE created_at <= ("
+        "SELECT created_at FROM ("
+        "SELECT created_at, SUM(size) OVER (ORDER BY created_at DESC) AS total FROM images"
+        ") WHERE total > ? ORDER BY created_at DESC LIMIT 1)",
+        (CACHE_MAX_BYTES,),
+    )
+
+def put(generator: str, prompt: str, aspect_ratio: str, image_data: str, mime_type: str, model: str):
+    """Store a generated image (base64 string) for later requests"""
+    global _bytes_since_prune
+    if not CACHE_ENABLED:
+        return
+    exact_key, loose_key = make_keys(generator, prompt, aspect_ratio)
+    now = time.time()
+    try:
+        with _lock:
+            conn = _connect()
+            # Without a separate loose key the row is only reachable by its
+            # exact key, which is also what an already-normalized prompt's
+            # loose lookups hash to
+            conn.execute(
+                "INSERT OR REPLACE INTO images "
+                "(exact_key, loose_key, image_data, mime_type, model, created_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (exact_key, loose_key or exact_key, image_data, mime_type, model, now, len(image_data)),
+            )
+            if _bytes_since_prune is None or _bytes_since_prune >= PRUNE_EVERY_BYTES:
+                _prune(conn, now)
+                _bytes_since_prune = 0
+            _bytes_since_prune += len(image_data)
+            conn.commit()
+    except sqlite3.Error:
+        # The cache is an optimization; never fail a generation because of it
+        pass
+
+def cached(generator: str, skip_models=()):
+    """
+    Decorator for generate functions taking (prompt, aspect_ratio, ...) and
+    returning the usual result dict. Successful results are stored unless they
+    came from one of skip_models (e.g. placeholder fallbacks).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(prompt: str, aspect_ratio: str = "16:9", *args, **kwargs):
+            hit = get(generator, prompt, aspect_ratio)
+            if hit:
+                return {
+                    "success": True,
+                    "image_data": hit["image_data"],
+                    "mime_type": hit["mime_type"],
+                    "prompt": prompt,
+                    "aspect_ratio": aspect_ratio,
+                    "model": hit["model"],
+                    "cached": True
+                }
+
+            result = func(prompt, aspect_ratio, *args, **kwargs)
+            if result.get("success") and result.get("model") not in skip_models:
+                put(generator, prompt, aspect_ratio, result["image_data"], result["mime_type"], result["model"])
+            return result
+        return wrapper
+    return decorator
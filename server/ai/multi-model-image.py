@@ -7,189 +7,375 @@ import sys
 import json
 import base64
 import io
-from PIL import Image as PILImage, ImageDraw, ImageFont, ImageFilter
+import shutil
+import functools
+import threading
+from typing import NamedTuple
+# Only the core Image module is loaded up front; ImageDraw, ImageFont and
+# ImageFilter are imported where used so a DALL-E hit never loads them
+from PIL import Image as PILImage
 import hashlib
-import math
 import random
+import image_cache
+import ndjson_worker
+from concurrent.futures import ThreadPoolExecutor
 
-def create_ai_styled_image(prompt: str, aspect_ratio: str = "16:9") -> bytes:
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    _HAS_REQUESTS = True
+except ImportError:
+    _HAS_REQUESTS = False
+
+# Output dimensions for each supported aspect ratio
+ASPECT_MAP = {
+    "1:1": (1024, 1024),
+    "16:9": (1024, 576),
+    "9:16": (576, 1024),
+    "4:3": (1024, 768),
+    "3:4": (768, 1024)
+}
+
+# DALL-E 3 output size per aspect ratio. Ratios it cannot produce request the
+# nearest size and are fitted to ASPECT_MAP locally
+DALLE_SIZES = {
+    "1:1": "1024x1024",
+    "16:9": "1792x1024",
+    "9:16": "1024x1792",
+    "4:3": "1024x1024",
+    "3:4": "1024x1024"
+}
+DALLE_FITTED_RATIOS = {"4:3", "3:4"}
+
+# Soften the final styled image; off by default since the effect is barely
+# visible and costs a full-frame filter pass
+ARTISTIC_BLUR = os.environ.get("AIMM_ARTISTIC_BLUR", "0").lower() not in ("", "0", "false")
+
+# Upper bound on image requests in flight at once for generate_images
+MAX_CONCURRENT_GENERATIONS = 5
+
+# Bump when the styled renderer's output changes so stale renders cached on
+# disk are not served
+STYLED_RENDERER_VERSION = 2
+STYLED_CACHE_NAMESPACE = f"ai-styled-v{STYLED_RENDERER_VERSION}"
+
+# Prompt keywords -> (keywords, gradient colors, accent color), first match wins
+THEMES = (
+    # Tech/Robot theme - blues and cyans
+    (("robot", "ai", "tech"), [(0, 100, 200), (0, 200, 255), (100, 150, 255)], (0, 255, 200)),
+    # Office theme - grays and blues
+    (("office", "work"), [(100, 120, 140), (150, 170, 190), (200, 210, 220)], (70, 130, 180)),
+    # Nature theme - greens
+    (("nature", "forest", "tree"), [(34, 139, 34), (60, 179, 113), (144, 238, 144)], (255, 215, 0)),
+    # Sunset theme - oranges and purples
+    (("sunset", "sunrise"), [(255, 94, 77), (255, 140, 90), (255, 190, 130)], (147, 112, 219)),
+    # Ocean theme - blues and teals
+    (("ocean", "water", "sea"), [(0, 119, 190), (0, 150, 199), (72, 202, 228)], (255, 255, 200)),
+)
+
+# Default vibrant colors
+DEFAULT_THEME = ((), [(102, 126, 234), (118, 75, 162), (237, 117, 130)], (255, 200, 100))
+
+
+class Style(NamedTuple):
+    """Visual style picked for a prompt"""
+    base_colors: list
+    accent_color: tuple
+    draw_robot: bool
+
+def _classify(prompt_lower: str) -> Style:
+    """Pick the theme colors and decorations for a lower-cased prompt in one pass"""
+    _, base_colors, accent_color = next(
+        (theme for theme in THEMES if any(k in prompt_lower for k in theme[0])),
+        DEFAULT_THEME
+    )
+    return Style(base_colors, accent_color, "robot" in prompt_lower)
+
+FONT_BOLD = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+FONT_REGULAR = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+@functools.lru_cache(maxsize=64)
+def _get_title_font(size: int):
+    """Load the title font once per pixel size, falling back to PIL's default"""
+    from PIL import ImageFont
+    
+    try:
+        return ImageFont.truetype(FONT_BOLD, size=size)
+    except OSError:
+        return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=64)
+def _get_subtitle_font(size: int):
+    """Load the subtitle font once per pixel size, falling back to PIL's default"""
+    from PIL import ImageFont
+    
+    try:
+        return ImageFont.truetype(FONT_REGULAR, size=size)
+    except OSError:
+        return ImageFont.load_default()
+
+def _vertical_gradient(width: int, height: int, colors: list) -> PILImage.Image:
+    """
+    Build a top-to-bottom gradient through evenly spaced color stops
+    
+    The stops are written into a 1-pixel-wide column and stretched with a
+    single bilinear resize, so the interpolation runs in Pillow's C resampler.
+    The source box spans the first to last pixel centres, putting the first
+    and last colors exactly at the top and bottom edges. The result is opaque
+    RGBA so overlays can be composited onto it in place.
+    """
+    stops = PILImage.new('RGBA', (1, len(colors)))
+    stops.putdata([(*color, 255) for color in colors])
+    return stops.resize(
+        (width, height), PILImage.Resampling.BILINEAR, box=(0, 0.5, 1, len(colors) - 0.5)
+    )
+
+@functools.lru_cache(maxsize=8)
+def _gradient_bytes(width: int, height: int, colors: tuple) -> bytes:
+    """
+    Raw RGBA pixels of a gradient, memoized per size and theme
+    
+    Only a handful of themes and aspect ratios exist, so the background for a
+    repeat combination is a single copy out of this cache.
+    """
+    return _vertical_gradient(width, height, list(colors)).tobytes()
+
+def _draw_dot(draw, cx: int, cy: int, r: int, fill):
+    """Draw a filled circle of radius r centred on (cx, cy)"""
+    draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=fill)
+
+@functools.lru_cache(maxsize=128)
+def _text_mask(text: str, font):
+    """
+    Rasterize text once into a grayscale mask
+    
+    Returns:
+        (mask, (left, top)) where (left, top) is the glyph box offset from
+        the drawing origin, as reported by the font
+    """
+    from PIL import ImageDraw
+    
+    # textbbox, unlike font.getbbox, measures every line of multi-line text
+    left, top, right, bottom = ImageDraw.Draw(PILImage.new('L', (1, 1))).textbbox((0, 0), text, font=font)
+    mask = PILImage.new('L', (right - left, bottom - top))
+    ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font)
+    return mask, (left, top)
+
+def _stamp_text(img, mask, offset, xy, fill, shadow_fill, shadow_offset: int):
+    """Paste a pre-rendered text mask as a drop shadow and then the text itself"""
+    x = xy[0] + offset[0]
+    y = xy[1] + offset[1]
+    img.paste(shadow_fill, (x + shadow_offset, y + shadow_offset), mask)
+    img.paste(fill, (x, y), mask)
+
+def _render_ai_styled_image(prompt: str, aspect_ratio: str = "16:9") -> io.BytesIO:
     """
     Create an AI-styled image based on the prompt using advanced PIL techniques
+    
+    The random decoration is seeded from the prompt, so the same request always
+    renders the same image and results can be cached.
+    
+    Returns:
+        BytesIO holding the encoded PNG
     """
+    from PIL import ImageDraw
+    
     # Determine dimensions
-    aspect_map = {
-        "1:1": (1024, 1024),
-        "16:9": (1024, 576),
-        "9:16": (576, 1024),
-        "4:3": (1024, 768),
-        "3:4": (768, 1024)
-    }
-    width, height = aspect_map.get(aspect_ratio, (1024, 576))
+    width, height = ASPECT_MAP.get(aspect_ratio, (1024, 576))
     
-    # Analyze prompt to determine style
-    prompt_lower = prompt.lower()
+    # Seed decoration from a hash of the request
+    key = hashlib.blake2b(f"{prompt}|{aspect_ratio}".encode(), digest_size=16).hexdigest()
+    rng = random.Random(int(key, 16))
     
-    # Create base image
-    img = PILImage.new('RGB', (width, height))
-    draw = ImageDraw.Draw(img)
+    min_dim = min(width, height)
     
-    # Generate colors based on prompt content
-    if 'robot' in prompt_lower or 'ai' in prompt_lower or 'tech' in prompt_lower:
-        # Tech/Robot theme - blues and cyans
-        base_colors = [(0, 100, 200), (0, 200, 255), (100, 150, 255)]
-        accent_color = (0, 255, 200)
-    elif 'office' in prompt_lower or 'work' in prompt_lower:
-        # Office theme - grays and blues
-        base_colors = [(100, 120, 140), (150, 170, 190), (200, 210, 220)]
-        accent_color = (70, 130, 180)
-    elif 'nature' in prompt_lower or 'forest' in prompt_lower or 'tree' in prompt_lower:
-        # Nature theme - greens
-        base_colors = [(34, 139, 34), (60, 179, 113), (144, 238, 144)]
-        accent_color = (255, 215, 0)
-    elif 'sunset' in prompt_lower or 'sunrise' in prompt_lower:
-        # Sunset theme - oranges and purples
-        base_colors = [(255, 94, 77), (255, 140, 90), (255, 190, 130)]
-        accent_color = (147, 112, 219)
-    elif 'ocean' in prompt_lower or 'water' in prompt_lower or 'sea' in prompt_lower:
-        # Ocean theme - blues and teals
-        base_colors = [(0, 119, 190), (0, 150, 199), (72, 202, 228)]
-        accent_color = (255, 255, 200)
-    else:
-        # Default vibrant colors
-        base_colors = [(102, 126, 234), (118, 75, 162), (237, 117, 130)]
-        accent_color = (255, 200, 100)
+    # Analyze prompt to determine style
+    style = _classify(prompt.lower())
+    base_colors = style.base_colors
+    accent_color = style.accent_color
     
     # Create gradient background
-    for y in range(height):
-        # Multi-color gradient
-        progress = y / height
-        if progress < 0.5:
-            ratio = progress * 2
-            r = int(base_colors[0][0] * (1 - ratio) + base_colors[1][0] * ratio)
-            g = int(base_colors[0][1] * (1 - ratio) + base_colors[1][1] * ratio)
-            b = int(base_colors[0][2] * (1 - ratio) + base_colors[1][2] * ratio)
-        else:
-            ratio = (progress - 0.5) * 2
-            r = int(base_colors[1][0] * (1 - ratio) + base_colors[2][0] * ratio)
-            g = int(base_colors[1][1] * (1 - ratio) + base_colors[2][1] * ratio)
-            b = int(base_colors[1][2] * (1 - ratio) + base_colors[2][2] * ratio)
-        
-        draw.rectangle([(0, y), (width, y+1)], fill=(r, g, b))
+    img = PILImage.frombytes('RGBA', (width, height), _gradient_bytes(width, height, tuple(base_colors)))
+    draw = ImageDraw.Draw(img)
     
     # Add visual elements based on prompt
-    if 'robot' in prompt_lower:
-        # Draw a stylized robot
-        robot_x = width // 2
-        robot_y = height // 2
+    if style.draw_robot:
+        # Draw a stylized robot, with all coordinates precomputed as integers
+        cx = width // 2
+        cy = height // 2
+        hs = min_dim // 6
+        hs_half = hs // 2
+        hs_3_2 = (hs * 3) // 2
+        hs_6_5 = (hs * 6) // 5
         
         # Robot head
-        head_size = min(width, height) // 6
-        draw.rectangle([robot_x - head_size, robot_y - head_size*2, 
-                       robot_x + head_size, robot_y - head_size//2],
-                      fill=(80, 80, 100), outline=(200, 200, 220), width=3)
+        draw.rectangle((cx - hs, cy - hs * 2, cx + hs, cy - hs_half),
+                       fill=(80, 80, 100), outline=(200, 200, 220), width=3)
         
         # Robot eyes
-        eye_size = head_size // 4
-        draw.ellipse([robot_x - head_size//2 - eye_size//2, robot_y - head_size*1.5 - eye_size//2,
-                     robot_x - head_size//2 + eye_size//2, robot_y - head_size*1.5 + eye_size//2],
-                    fill=accent_color)
-        draw.ellipse([robot_x + head_size//2 - eye_size//2, robot_y - head_size*1.5 - eye_size//2,
-                     robot_x + head_size//2 + eye_size//2, robot_y - head_size*1.5 + eye_size//2],
-                    fill=accent_color)
+        eye_radius = (hs // 4) // 2
+        _draw_dot(draw, cx - hs_half, cy - hs_3_2, eye_radius, accent_color)
+        _draw_dot(draw, cx + hs_half, cy - hs_3_2, eye_radius, accent_color)
         
         # Robot body
-        draw.rectangle([robot_x - head_size*1.2, robot_y - head_size//2,
-                       robot_x + head_size*1.2, robot_y + head_size*1.5],
-                      fill=(100, 100, 120), outline=(200, 200, 220), width=3)
+        draw.rectangle((cx - hs_6_5, cy - hs_half, cx + hs_6_5, cy + hs_3_2),
+                       fill=(100, 100, 120), outline=(200, 200, 220), width=3)
         
         # Robot arms
-        arm_width = head_size // 3
-        draw.rectangle([robot_x - head_size*2, robot_y,
-                       robot_x - head_size*1.2, robot_y + arm_width],
-                      fill=(90, 90, 110))
-        draw.rectangle([robot_x + head_size*1.2, robot_y,
-                       robot_x + head_size*2, robot_y + arm_width],
-                      fill=(90, 90, 110))
-    
-    # Add geometric shapes for abstract feel
-    num_shapes = random.randint(3, 7)
-    for _ in range(num_shapes):
-        shape_type = random.choice(['circle', 'rectangle', 'triangle'])
-        x = random.randint(0, width)
-        y = random.randint(0, height)
-        size = random.randint(20, min(width, height) // 8)
-        alpha = random.randint(30, 100)
-        color = (*random.choice(base_colors + [accent_color]), alpha)
-        
+        arm_width = hs // 3
+        draw.rectangle((cx - hs * 2, cy, cx - hs_6_5, cy + arm_width), fill=(90, 90, 110))
+        draw.rectangle((cx + hs_6_5, cy, cx + hs * 2, cy + arm_width), fill=(90, 90, 110))
+    
+    # Add geometric shapes for abstract feel, all drawn into one overlay
+    # so the frame is composited once rather than once per shape
+    overlay = PILImage.new('RGBA', (width, height), (0, 0, 0, 0))
+    overlay_draw = ImageDraw.Draw(overlay)
+    # Sample every shape's parameters up front with one batched call each
+    num_shapes = rng.randint(3, 7)
+    shape_types = rng.choices(('circle', 'rectangle', 'triangle'), k=num_shapes)
+    xs = rng.choices(range(width + 1), k=num_shapes)
+    ys = rng.choices(range(height + 1), k=num_shapes)
+    sizes = rng.choices(range(20, min_dim // 8 + 1), k=num_shapes)
+    alphas = rng.choices(range(30, 101), k=num_shapes)
+    fills = rng.choices(base_colors + [accent_color], k=num_shapes)
+    
+    for shape_type, x, y, size, alpha, fill in zip(shape_types, xs, ys, sizes, alphas, fills):
+        color = (*fill, alpha)
         if shape_type == 'circle':
-            overlay = PILImage.new('RGBA', (width, height), (0, 0, 0, 0))
-            overlay_draw = ImageDraw.Draw(overlay)
-            overlay_draw.ellipse([x-size, y-size, x+size, y+size], fill=color)
-            img = PILImage.alpha_composite(img.convert('RGBA'), overlay).convert('RGB')
+            overlay_draw.ellipse((x - size, y - size, x + size, y + size), fill=color)
         elif shape_type == 'rectangle':
-            overlay = PILImage.new('RGBA', (width, height), (0, 0, 0, 0))
-            overlay_draw = ImageDraw.Draw(overlay)
-            overlay_draw.rectangle([x-size, y-size, x+size, y+size], fill=color)
-            img = PILImage.alpha_composite(img.convert('RGBA'), overlay).convert('RGB')
+            overlay_draw.rectangle((x - size, y - size, x + size, y + size), fill=color)
+    
+    # Blend only the region the shapes actually cover, in place; the base is
+    # already RGBA so no mode conversions are needed
+    bbox = overlay.getbbox()
+    if bbox:
+        img.alpha_composite(overlay, dest=bbox[:2], source=bbox)
     
     # Add text overlay with prompt info
-    try:
-        # Try to use a nice font
-        title_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 
-                                       size=int(height * 0.06))
-        subtitle_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 
-                                          size=int(height * 0.03))
-    except:
-        title_font = ImageFont.load_default()
-        subtitle_font = ImageFont.load_default()
-    
-    # Add title
+    title_font = _get_title_font(int(height * 0.06))
+    subtitle_font = _get_subtitle_font(int(height * 0.03))
+    
+    # Add title, rasterized once and stamped twice for a shadow effect
     title = "AI Generated"
-    bbox = draw.textbbox((0, 0), title, font=title_font)
-    text_width = bbox[2] - bbox[0]
-    text_x = (width - text_width) // 2
+    mask, offset = _text_mask(title, title_font)
+    text_x = (width - mask.width) // 2
     text_y = height - int(height * 0.15)
-    
-    # Draw text with shadow effect
-    shadow_offset = 2
-    draw.text((text_x + shadow_offset, text_y + shadow_offset), title, 
-             fill=(0, 0, 0, 128), font=title_font)
-    draw.text((text_x, text_y), title, fill=(255, 255, 255), font=title_font)
+    _stamp_text(img, mask, offset, (text_x, text_y), (255, 255, 255), (0, 0, 0), 2)
     
     # Add prompt subtitle
     prompt_display = prompt[:80] + "..." if len(prompt) > 80 else prompt
-    bbox = draw.textbbox((0, 0), prompt_display, font=subtitle_font)
-    text_width = bbox[2] - bbox[0]
-    text_x = (width - text_width) // 2
+    mask, offset = _text_mask(prompt_display, subtitle_font)
+    text_x = (width - mask.width) // 2
     text_y = height - int(height * 0.08)
+    _stamp_text(img, mask, offset, (text_x, text_y), (255, 255, 255), (0, 0, 0), 1)
     
-    draw.text((text_x + 1, text_y + 1), prompt_display, 
-             fill=(0, 0, 0, 100), font=subtitle_font)
-    draw.text((text_x, text_y), prompt_display, 
-             fill=(255, 255, 255, 200), font=subtitle_font)
-    
-    # Apply a slight blur for artistic effect
-    img = img.filter(ImageFilter.GaussianBlur(radius=0.5))
+    # Optional slight blur for artistic effect
+    if ARTISTIC_BLUR:
+        from PIL import ImageFilter
+        img = img.filter(ImageFilter.BoxBlur(1))
     
-    # Convert to bytes
+    # Encode as PNG, flattening to RGB once at the end
     buffer = io.BytesIO()
-    img.save(buffer, format='PNG', optimize=True)
-    return buffer.getvalue()
+    img.convert('RGB').save(buffer, format='PNG', optimize=False, compress_level=1)
+    return buffer
+
+def create_ai_styled_image(prompt: str, aspect_ratio: str = "16:9") -> bytes:
+    """Create an AI-styled image and return the raw PNG bytes"""
+    return _render_ai_styled_image(prompt, aspect_ratio).getvalue()
 
-def generate_image(prompt: str, aspect_ratio: str = "16:9") -> dict:
+@functools.lru_cache(maxsize=256)
+def create_ai_styled_image_b64(prompt: str, aspect_ratio: str = "16:9") -> str:
+    """
+    Create an AI-styled image and return it base64 encoded
+    
+    Renders are deterministic, so they are memoized here and backed by the
+    disk cache in their own namespace; a later DALL-E result for the same
+    prompt is never shadowed by a placeholder. The image prints the prompt,
+    so only exact-key disk hits are used. Fresh renders encode straight from
+    the PNG buffer's memory, skipping the intermediate bytes copy
+    create_ai_styled_image would make.
+    """
+    cached = image_cache.get(STYLED_CACHE_NAMESPACE, prompt, aspect_ratio, exact_only=True)
+    if cached:
+        return cached["image_data"]
+    
+    buffer = _render_ai_styled_image(prompt, aspect_ratio)
+    image_data = base64.b64encode(buffer.getbuffer()).decode('ascii')
+    image_cache.put(STYLED_CACHE_NAMESPACE, prompt, aspect_ratio, image_data, "image/png", "ai-styled-generator")
+    return image_data
+
+def _fit_png(buffer: io.BytesIO, size: tuple) -> io.BytesIO:
+    """Center-crop and Lanczos-resize an encoded image to size, re-encoding once as PNG"""
+    from PIL import ImageOps
+    
+    img = ImageOps.fit(PILImage.open(buffer), size, PILImage.Resampling.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format='PNG', optimize=False, compress_level=1)
+    return out
+
+_session = None
+_session_lock = threading.Lock()
+
+def _get_session():
+    """
+    Return the process-wide HTTP session used for OpenAI and image downloads
+    
+    Keep-alive connections are pooled across requests. Image downloads are
+    retried with backoff on throttling and transient server errors. The
+    billable OpenAI POST is only retried when it was throttled (429) or never
+    reached the server (connect errors) - a read timeout or 5xx may mean the
+    image was already generated and charged.
+    """
+    global _session
+    if _session is None:
+        # Batch threads may all arrive here at once; build only one session
+        with _session_lock:
+            if _session is None:
+                download_retry = Retry(
+                    total=3,
+                    backoff_factor=0.5,
+                    status_forcelist=[429, 500, 502, 503, 504]
+                )
+                api_retry = Retry(
+                    total=3,
+                    read=0,
+                    backoff_factor=0.5,
+                    status_forcelist=[429],
+                    allowed_methods=frozenset({"POST"})
+                )
+                _session = requests.Session()
+                _session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=download_retry))
+                _session.mount("https://api.openai.com/", HTTPAdapter(pool_connections=1, pool_maxsize=32, max_retries=api_retry))
+    return _session
+
+@image_cache.cached("multi-model", skip_models=("ai-styled-generator",))
+def generate_image(prompt: str, aspect_ratio: str = "16:9", fallback: bool = True) -> dict:
     """
     Generate an image using available methods
+    
+    Args:
+        prompt: The text prompt to generate image from
+        aspect_ratio: The desired aspect ratio
+        fallback: Render an AI-styled placeholder when DALL-E is unavailable;
+            when False the DALL-E error is returned instead
     """
     
     try:
         # Check for OpenAI API key first
         openai_key = os.environ.get("OPENAI_API_KEY")
-        if openai_key:
+        dalle_error = "DALL-E returned no image"
+        if not openai_key:
+            dalle_error = "OPENAI_API_KEY is not set"
+        elif not _HAS_REQUESTS:
+            dalle_error = "The requests package is not installed"
+        else:
             try:
-                import requests
+                session = _get_session()
                 
                 # Try DALL-E 3
-                response = requests.post(
+                response = session.post(
                     "https://api.openai.com/v1/images/generations",
                     headers={
                         "Authorization": f"Bearer {openai_key}",
@@ -199,7 +385,7 @@ def generate_image(prompt: str, aspect_ratio: str = "16:9") -> dict:
                         "model": "dall-e-3",
                         "prompt": prompt,
                         "n": 1,
-                        "size": "1024x1024" if aspect_ratio == "1:1" else "1792x1024",
+                        "size": DALLE_SIZES.get(aspect_ratio, DALLE_SIZES["16:9"]),
                         "quality": "standard"
                     },
                     timeout=30
@@ -210,26 +396,39 @@ def generate_image(prompt: str, aspect_ratio: str = "16:9") -> dict:
                     if result.get("data") and len(result["data"]) > 0:
                         image_url = result["data"][0]["url"]
                         
-                        # Download the image
-                        img_response = requests.get(image_url, timeout=10)
-                        if img_response.status_code == 200:
-                            return {
-                                "success": True,
-                                "image_data": base64.b64encode(img_response.content).decode('utf-8'),
-                                "mime_type": "image/png",
-                                "prompt": prompt,
-                                "aspect_ratio": aspect_ratio,
-                                "model": "dall-e-3"
-                            }
+                        # Stream the image into a single buffer and encode it in place
+                        with session.get(image_url, stream=True, timeout=10) as img_response:
+                            if img_response.status_code == 200:
+                                img_response.raw.decode_content = True
+                                buffer = io.BytesIO()
+                                shutil.copyfileobj(img_response.raw, buffer)
+                                if aspect_ratio in DALLE_FITTED_RATIOS:
+                                    buffer = _fit_png(buffer, ASPECT_MAP[aspect_ratio])
+                                return {
+                                    "success": True,
+                                    "image_data": base64.b64encode(buffer.getbuffer()).decode('ascii'),
+                                    "mime_type": "image/png",
+                                    "prompt": prompt,
+                                    "aspect_ratio": aspect_ratio,
+                                    "model": "dall-e-3"
+                                }
             except Exception as e:
+                dalle_error = str(e)
                 print(f"DALL-E generation failed: {e}", file=sys.stderr)
         
+        if not fallback:
+            return {
+                "success": False,
+                "error": f"DALL-E generation failed: {dalle_error}",
+                "prompt": prompt
+            }
+        
         # Fallback to AI-styled image generation
-        image_data = create_ai_styled_image(prompt, aspect_ratio)
+        image_data = create_ai_styled_image_b64(prompt, aspect_ratio)
         
         return {
             "success": True,
-            "image_data": base64.b64encode(image_data).decode('utf-8'),
+            "image_data": image_data,
             "mime_type": "image/png",
             "prompt": prompt,
             "aspect_ratio": aspect_ratio,
@@ -244,23 +443,66 @@ def generate_image(prompt: str, aspect_ratio: str = "16:9") -> dict:
             "prompt": prompt
         }
 
+def generate_images(prompts: list, aspect_ratio: str = "16:9", fallback: bool = True) -> list:
+    """
+    Generate several images concurrently
+    
+    DALL-E requests and downloads are network-bound, so up to
+    MAX_CONCURRENT_GENERATIONS of them are kept in flight at once.
+    Results are returned in the same order as prompts.
+    """
+    if not prompts:
+        return []
+    workers = min(MAX_CONCURRENT_GENERATIONS, len(prompts))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda p: generate_image(p, aspect_ratio, fallback), prompts))
+
+def handle_request(input_data: dict) -> dict:
+    """
+    Run one generation request
+    
+    Args:
+        input_data: {"prompt": ..., "aspectRatio": ..., "fallback": ...} or the
+            same with "prompts": [...] for a batch
+    
+    Returns:
+        result dict, {"results": [...]} for batches, or {"error": ...}
+    """
+    prompt = input_data.get('prompt', '')
+    prompts = input_data.get('prompts')
+    aspect_ratio = input_data.get('aspectRatio', '16:9')
+    fallback = input_data.get('fallback', True)
+    
+    # Batch request: {"prompts": [...]} -> {"results": [...]}
+    if prompts is not None and not ndjson_worker.is_prompt_list(prompts):
+        return {"error": "prompts must be a list of non-empty strings"}
+    if prompts:
+        return {"results": generate_images(prompts, aspect_ratio, fallback)}
+    
+    if not prompt:
+        return {"error": "No prompt provided"}
+    
+    return generate_image(prompt, aspect_ratio, fallback)
+
 def main():
     """Main entry point"""
     if len(sys.argv) < 2:
         print(json.dumps({"error": "No input provided"}))
         sys.exit(1)
     
+    if sys.argv[1] == "--server":
+        ndjson_worker.serve(handle_request)
+        return
+    
     try:
         input_data = json.loads(sys.argv[1])
-        prompt = input_data.get('prompt', '')
-        aspect_ratio = input_data.get('aspectRatio', '16:9')
         
-        if not prompt:
+        if not input_data.get('prompt') and not input_data.get('prompts'):
             print(json.dumps({"error": "No prompt provided"}))
             sys.exit(1)
         
-        result = generate_image(prompt, aspect_ratio)
-        print(json.dumps(result))
+        result = handle_request(input_data)
+        ndjson_worker.write_result(result)
         
     except Exception as e:
         print(json.dumps({"error": str(e)}))
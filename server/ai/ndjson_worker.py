@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Line-delimited JSON request loop shared by the Python image generators
+"""
+import sys
+import json
+
+def write_result(result: dict):
+    """
+    Write a result to stdout as a single JSON line
+
+    json.dump streams the encoded pieces straight to stdout, so the large
+    base64 image string is never joined into a second full JSON document
+    in memory.
+    """
+    json.dump(result, sys.stdout)
+    sys.stdout.write("\n")
+    sys.stdout.flush()
+
+def is_prompt_list(prompts) -> bool:
+    """Check that a batch is a list of non-empty prompt strings"""
+    return isinstance(prompts, list) and all(isinstance(p, str) and p.strip() for p in prompts)
+
+def serve(handle_request):
+    """
+    Persistent worker mode: read one JSON request per stdin line and write one
+    JSON result per stdout line, so imports, clients and in-memory caches are
+    set up once instead of per image. An "id" field on the request is echoed
+    back.
+
+    Args:
+        handle_request: Callable taking the request dict and returning the
+            result dict
+    """
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            input_data = json.loads(line)
+            if not isinstance(input_data, dict):
+                result = {"error": "Request must be a JSON object"}
+            else:
+                request_id = input_data.get('id')
+                result = handle_request(input_data)
+        except json.JSONDecodeError as e:
+            result = {"error": f"Invalid JSON input: {str(e)}"}
+        except Exception as e:
+            result = {"error": str(e)}
+        if request_id is not None:
+            result["id"] = request_id
+        write_result(result)
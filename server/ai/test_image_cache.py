@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for the prompt -> image cache keying
+
+Run from server/ai with: python -m unittest test_image_cache
+"""
+import os
+import tempfile
+import unittest
+
+import image_cache
+
+class MakeKeysTest(unittest.TestCase):
+    def test_rewordings_share_loose_key(self):
+        _, loose_a = image_cache.make_keys("genai", "A Robot, at work!", "1:1")
+        _, loose_b = image_cache.make_keys("genai", "a robot at   work", "1:1")
+        self.assertIsNotNone(loose_a)
+        self.assertEqual(loose_a, loose_b)
+
+    def test_non_latin_words_are_kept(self):
+        _, cat = image_cache.make_keys("genai", "Banner for 猫", "1:1")
+        _, dog = image_cache.make_keys("genai", "Banner for 犬", "1:1")
+        self.assertNotEqual(cat, dog)
+
+        _, cafe = image_cache.make_keys("genai", "Café", "1:1")
+        _, caf = image_cache.make_keys("genai", "Caf", "1:1")
+        self.assertNotEqual(cafe, caf)
+
+    def test_casefold_matches_non_ascii_case(self):
+        _, upper = image_cache.make_keys("genai", "STRASSE!", "1:1")
+        _, lower = image_cache.make_keys("genai", "straße", "1:1")
+        self.assertEqual(upper, lower)
+
+    def test_no_loose_key_without_words(self):
+        self.assertIsNone(image_cache.make_keys("genai", "!!! ???", "1:1")[1])
+
+    def test_no_loose_key_when_already_normalized(self):
+        exact, loose = image_cache.make_keys("genai", "banner for 猫", "1:1")
+        self.assertIsNone(loose)
+        # Its exact key is what rewordings look up loosely
+        self.assertEqual(exact, image_cache.make_keys("genai", "Banner for 猫!", "1:1")[1])
+
+    def test_keys_depend_on_generator_and_aspect_ratio(self):
+        base = image_cache.make_keys("genai", "A cat", "1:1")
+        self.assertNotEqual(base, image_cache.make_keys("multi-model", "A cat", "1:1"))
+        self.assertNotEqual(base, image_cache.make_keys("genai", "A cat", "16:9"))
+
+class LookupTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.saved = (
+            image_cache.CACHE_PATH, image_cache.CACHE_ENABLED, image_cache.CACHE_MAX_BYTES,
+            image_cache.PRUNE_EVERY_BYTES, image_cache._conn, image_cache._bytes_since_prune
+        )
+        image_cache.CACHE_PATH = os.path.join(self.tmpdir.name, "cache.sqlite3")
+        image_cache.CACHE_ENABLED = True
+        image_cache._conn = None
+        image_cache._bytes_since_prune = None
+
+    def tearDown(self):
+        if image_cache._conn is not None:
+            image_cache._conn.close()
+        (
+            image_cache.CACHE_PATH, image_cache.CACHE_ENABLED, image_cache.CACHE_MAX_BYTES,
+            image_cache.PRUNE_EVERY_BYTES, image_cache._conn, image_cache._bytes_since_prune
+        ) = self.saved
+        self.tmpdir.cleanup()
+
+    def test_non_latin_prompts_do_not_collide(self):
+        image_cache.put("genai", "banner for 猫", "1:1", "CAT", "image/png", "m")
+        self.assertIsNone(image_cache.get("genai", "banner for 犬", "1:1"))
+        self.assertEqual(image_cache.get("genai", "Banner for 猫!", "1:1")["image_data"], "CAT")
+
+    def test_wordless_prompts_only_hit_exactly(self):
+        image_cache.put("genai", "???", "1:1", "Q", "image/png", "m")
+        self.assertIsNone(image_cache.get("genai", "!!!", "1:1"))
+        self.assertEqual(image_cache.get("genai", "???", "1:1")["image_data"], "Q")
+
+    def test_exact_only_skips_loose_match(self):
+        image_cache.put("genai", "A cat", "1:1", "CAT", "image/png", "m")
+        self.assertIsNone(image_cache.get("genai", "a cat!", "1:1", exact_only=True))
+        self.assertIsNotNone(image_cache.get("genai", "a cat!", "1:1"))
+
+    def test_prune_keeps_newest_images_within_byte_cap(self):
+        image_cache.CACHE_MAX_BYTES = 250
+        image_cache.PRUNE_EVERY_BYTES = 0
+        for i in range(5):
+            image_cache.put("genai", f"prompt {i}", "1:1", "x" * 100, "image/png", "m")
+        stored = image_cache._conn.execute("SELECT SUM(size) FROM images").fetchone()[0]
+        self.assertLessEqual(stored, 250)
+        self.assertIsNotNone(image_cache.get("genai", "prompt 4", "1:1"))
+        self.assertIsNone(image_cache.get("genai", "prompt 0", "1:1"))
+
+if __name__ == "__main__":
+    unittest.main()